@@ -4,17 +4,34 @@ Fixed: Preview images not showing after adjustments
 """
 
 import os
-import uuid
-import zipfile
+import re
+import secrets
+import shutil
 import tempfile
+import time
 import logging
+import threading
+import functools
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import unquote
+try:
+    import fcntl
+except ImportError:  # Windows dev server: a single process, no election needed
+    fcntl = None
+from cachetools import cached, TTLCache
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, request, jsonify, send_file, session
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, session
+from zipstream import ZipStream, ZIP_STORED
+import PIL
+from PIL import Image, features
 
 # Import utility modules
 from utils.image_processor import ImageProcessor
-from utils.dpi_checker import check_dpi
+from utils.preview_tasks import build_previews, load_preview_result
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -35,7 +52,7 @@ app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))
 app.config['MAX_CONTENT_LENGTH'] = 15 * 1024 * 1024  # 15MB
 
 # File type restrictions
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'tiff', 'tif'}
+app.config['ALLOWED_EXTENSIONS'] = frozenset({'png', 'jpg', 'jpeg', 'tiff', 'tif'})
 
 # Use /tmp directory for Render compatibility
 UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'ara_uploads')
@@ -48,6 +65,54 @@ os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
 
+# Image work (previews, adjustments, downloads) runs on one shared thread pool.
+# Pillow releases the GIL in resize/encode, but each busy thread holds a
+# decoded image and every gunicorn worker has its own pool, so the default
+# stays at 2; raise ARA_MAX_WORKERS where memory allows.
+app.config['MAX_WORKERS'] = max(1, int(os.environ.get('ARA_MAX_WORKERS', 2)))
+IMG_POOL = ThreadPoolExecutor(max_workers=app.config['MAX_WORKERS'],
+                              thread_name_prefix='ara-img')
+
+# Printing guide bundled with every download; read once, it never changes at runtime
+try:
+    with open(os.path.join(app.static_folder, 'Printing_Guide.pdf'), 'rb') as f:
+        PRINTING_GUIDE_BYTES = f.read()
+except FileNotFoundError:
+    PRINTING_GUIDE_BYTES = None
+
+# Background cleaner: session directories untouched for SESSION_MAX_AGE are removed
+app.config['SESSION_MAX_AGE'] = 24 * 60 * 60  # 24 hours
+app.config['CLEANUP_INTERVAL'] = 30 * 60  # 30 minutes
+app.config['SESSION_SWEEP_INTERVAL'] = 60  # per-worker session index expiry
+
+# Every worker runs the cleanup timer; only the one holding this lock sweeps.
+# Kept outside the swept folders so the sweep never deletes it.
+CLEANUP_LOCK_PATH = os.path.join(tempfile.gettempdir(), 'ara_cleanup.lock')
+
+# Hard cap on live sessions, so a traffic burst cannot fill /tmp; the oldest
+# sessions beyond it are deleted outright
+app.config['MAX_SESSIONS'] = max(1, int(os.environ.get('ARA_MAX_SESSIONS', 256)))
+
+# Preview jobs run off the request thread: on RQ when REDIS_URL is set,
+# otherwise (free tier) on IMG_POOL. RQ mode needs the optional rq and redis
+# packages (commented pins in requirements.txt) and an `rq worker` process.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    from redis import Redis
+    from rq import Queue
+    from rq.job import Job
+    preview_queue = Queue(connection=Redis.from_url(REDIS_URL))
+else:
+    preview_queue = None
+
+# Optional: let a fronting nginx serve previews via X-Accel-Redirect, e.g.
+#   ARA_ACCEL_REDIRECT_PREFIX=/internal_previews/
+#   location /internal_previews/ { internal; alias /tmp/ara_processed/; }
+# Unset (the default) serves previews from Flask with send_from_directory.
+app.config['ACCEL_REDIRECT_PREFIX'] = os.environ.get('ARA_ACCEL_REDIRECT_PREFIX')
+
+PREVIEW_JOBS = {}  # session_id -> Future (in-process pool only)
+
 # ============================================================================
 # 3. LOGGING SETUP
 # ============================================================================
@@ -57,37 +122,405 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 app.logger = logging.getLogger(__name__)
-app.logger.info('Aspect-Ratio Automator starting up...')
+app.logger.info(f'Aspect-Ratio Automator starting up... (Pillow {PIL.__version__}, '
+                f'libjpeg-turbo: {features.check_feature("libjpeg_turbo")})')
 
 # ============================================================================
 # 4. HELPER FUNCTIONS
 # ============================================================================
 
+@functools.lru_cache(maxsize=64)
+def _ext_ok(ext):
+    return ext.lower() in app.config['ALLOWED_EXTENSIONS']
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    i = filename.rfind('.')
+    return i >= 0 and _ext_ok(filename[i + 1:])
+
+def validate_file_size(content_length):
+    """
+    Check a declared upload size against MAX_CONTENT_LENGTH.
+    
+    Returns:
+        (ok, error message or None)
+    """
+    max_bytes = app.config['MAX_CONTENT_LENGTH']
+    if content_length > max_bytes:
+        return False, f'File size exceeds {max_bytes / 1024 / 1024}MB limit'
+    return True, None
+
+def save_stream(stream, path, chunk_size=1024 * 1024):
+    """
+    Copy an upload stream to path in chunks, counting bytes as they arrive.
+    Raises RequestEntityTooLarge once MAX_CONTENT_LENGTH is exceeded, which
+    also covers bodies sent without a Content-Length.
+    """
+    limit = app.config['MAX_CONTENT_LENGTH']
+    written = 0
+    with open(path, 'wb') as f:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > limit:
+                raise RequestEntityTooLarge()
+            f.write(chunk)
+    return written
+
+_CLEAN_RE = re.compile(r'[^\w\s\-_.]')
+_SPACE_TR = str.maketrans({' ': '_'})
 
 def clean_filename(filename):
     """Clean filename for safe usage."""
-    import re
-    name = re.sub(r'[^\w\s\-_.]', '', filename)
-    name = name.replace(' ', '_')
+    name = _CLEAN_RE.sub('', filename).translate(_SPACE_TR)
     if len(name) > 100:
         name = name[:50] + "_" + name[-50:]
     return name
 
+# In-process session index (LRU order):
+#   session_id -> {'original_path', 'original_filename', 'previews', 'processor', 'ts'}
+# Entries idle for SESSION_INDEX_TTL are dropped; lookups then fall back to disk.
+# Each session owns UPLOAD_FOLDER/<session_id>/ and PROCESSED_FOLDER/<session_id>/
+SESSION_INDEX = OrderedDict()
+SESSION_INDEX_LOCK = threading.Lock()
+SESSION_INDEX_TTL = 30 * 60  # 30 minutes
+SESSION_INDEX_MAX = app.config['MAX_SESSIONS']
+
+_SESSION_ID_CHARS = frozenset('0123456789abcdef-')
+
+def is_valid_session_id(session_id):
+    """Check a client-supplied session ID before using it in a path."""
+    return isinstance(session_id, str) and 8 <= len(session_id) <= 64 and \
+           all(c in _SESSION_ID_CHARS for c in session_id)
+
+def get_session_dirs(session_id):
+    """Return the (upload, processed) directories for a session."""
+    return os.path.join(UPLOAD_FOLDER, session_id), os.path.join(PROCESSED_FOLDER, session_id)
+
+def remember_session(session_id, original_path, original_filename):
+    """Record a new upload in the session index."""
+    now = time.monotonic()
+    with SESSION_INDEX_LOCK:
+        SESSION_INDEX[session_id] = {
+            'original_path': original_path,
+            'original_filename': original_filename,
+            'previews': None,
+            'processor': None,
+            'ts': now
+        }
+        SESSION_INDEX.move_to_end(session_id)
+        
+        # Oldest entries sit at the front: idle ones just leave the index,
+        # ones pushed out by the cap lose their files too
+        idle, over_cap = [], []
+        while SESSION_INDEX:
+            oldest_id, oldest = next(iter(SESSION_INDEX.items()))
+            if len(SESSION_INDEX) > SESSION_INDEX_MAX:
+                over_cap.append(oldest_id)
+            elif now - oldest['ts'] >= SESSION_INDEX_TTL:
+                idle.append(oldest_id)
+            else:
+                break
+            SESSION_INDEX.popitem(last=False)
+    
+    for sid in idle:
+        drop_processor(sid)
+    for sid in over_cap:
+        drop_processor(sid)
+        remove_session_dirs(sid)
+        app.logger.info(f'Session cap reached: evicted {sid[:8]}')
+
+def remove_session_dirs(session_id):
+    """Delete a session's upload and processed directories; returns how many existed."""
+    removed = 0
+    for session_dir in get_session_dirs(session_id):
+        if os.path.isdir(session_dir):
+            shutil.rmtree(session_dir, ignore_errors=True)
+            removed += 1
+    return removed
+
+def get_session_entry(session_id):
+    """Return a live index entry (marking it recently used), or None."""
+    now = time.monotonic()
+    with SESSION_INDEX_LOCK:
+        entry = SESSION_INDEX.get(session_id)
+        if entry is None:
+            return None
+        if now - entry['ts'] >= SESSION_INDEX_TTL:
+            del SESSION_INDEX[session_id]
+            return None
+        entry['ts'] = now
+        SESSION_INDEX.move_to_end(session_id)
+        return entry
+
+def forget_session(session_id):
+    """Drop a session from the index."""
+    with SESSION_INDEX_LOCK:
+        SESSION_INDEX.pop(session_id, None)
+    drop_processor(session_id)
+
+# Each indexed session keeps its ImageProcessor in its SESSION_INDEX entry, so
+# /adjust and /download reuse it (and its preview caches) instead of building
+# one per request. The full-size source is only held while a download renders;
+# the most recently used few keep their caches, the rest are closed.
+WARM_PROCESSORS = OrderedDict()  # session_id -> processor holding decoded caches
+WARM_PROCESSORS_LOCK = threading.Lock()
+WARM_PROCESSORS_MAX = max(1, int(os.environ.get('ARA_PROCESSOR_CACHE', 2)))
+
+def get_processor(session_id, original_path, processed_dir):
+    """Return the session's ImageProcessor, creating and indexing it if needed."""
+    entry = get_session_entry(session_id)
+    if entry is None:
+        processor = ImageProcessor(original_path, session_id, processed_dir)
+    else:
+        # Check and create under the index lock: two first requests must not
+        # each build one, leaving an orphan WARM_PROCESSORS doesn't bound
+        with SESSION_INDEX_LOCK:
+            processor = entry.get('processor')
+            if processor is None or processor.image_path != original_path:
+                processor = ImageProcessor(original_path, session_id, processed_dir)
+                entry['processor'] = processor
+    
+    evicted = []
+    with WARM_PROCESSORS_LOCK:
+        WARM_PROCESSORS[session_id] = processor
+        WARM_PROCESSORS.move_to_end(session_id)
+        while len(WARM_PROCESSORS) > WARM_PROCESSORS_MAX:
+            evicted.append(WARM_PROCESSORS.popitem(last=False)[1])
+    for old in evicted:
+        old.close()
+    return processor
+
+def drop_processor(session_id):
+    """Close a session's processor so its decoded source is freed."""
+    with WARM_PROCESSORS_LOCK:
+        processor = WARM_PROCESSORS.pop(session_id, None)
+    if processor:
+        processor.close()
+
 def get_session_original_path(session_id):
     """Find the original uploaded file for a session."""
-    if not session_id:
+    if not is_valid_session_id(session_id):
         return None
     
-    for file in os.listdir(UPLOAD_FOLDER):
-        if file.startswith(session_id):
-            return os.path.join(UPLOAD_FOLDER, file)
+    entry = get_session_entry(session_id)
+    if entry:
+        return entry['original_path']
+    
+    # Miss: session created by another worker or before a restart. Find it
+    # on disk once, then index it so later requests skip the filesystem.
+    original_path = find_original_on_disk(session_id)
+    if original_path:
+        own_cookie = session.get('session_id') == session_id
+        remember_session(session_id, original_path, session.get('orig_name') if own_cookie else None)
+    return original_path
+
+def find_original_on_disk(session_id):
+    """Locate a session's original upload without the index."""
+    # The cookie carries the extension, so the path is known without a scan
+    upload_dir = get_session_dirs(session_id)[0]
+    if session.get('session_id') == session_id and 'orig_ext' in session:
+        original_path = os.path.join(upload_dir, 'orig' + session['orig_ext'])
+        if os.path.isfile(original_path):
+            return original_path
+    try:
+        with os.scandir(upload_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith('orig') and entry.is_file():
+                    return entry.path
+    except FileNotFoundError:
+        pass
     
     return None
 
+def cleanup_old_files(max_age=None):
+    """Remove session directories (and stray files) older than max_age seconds."""
+    cutoff = time.time() - (max_age or app.config['SESSION_MAX_AGE'])
+    removed = 0
+    
+    for folder in (UPLOAD_FOLDER, PROCESSED_FOLDER):
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    # is_dir comes from the directory read itself; only the
+                    # mtime costs a syscall (lstat, so links are never followed)
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                        continue
+                    try:
+                        if is_dir:
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                        else:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue  # removed concurrently (e.g. by /cleanup)
+                    forget_session(entry.name)
+                    removed += 1
+        except OSError as e:
+            app.logger.warning(f'Cleanup of {folder} failed: {e}')
+    
+    removed += enforce_session_cap()
+    
+    if removed:
+        app.logger.info(f'Old file cleanup: {removed} entries removed')
+    return removed
+
+def enforce_session_cap():
+    """
+    Delete the oldest session directories beyond MAX_SESSIONS.
+    Covers sessions from every worker, not just those in this index.
+    """
+    try:
+        with os.scandir(UPLOAD_FOLDER) as entries:
+            sessions = [(entry.stat(follow_symlinks=False).st_mtime, entry.name)
+                        for entry in entries if entry.is_dir(follow_symlinks=False)]
+    except OSError as e:
+        app.logger.warning(f'Session cap check failed: {e}')
+        return 0
+    
+    excess = len(sessions) - app.config['MAX_SESSIONS']
+    if excess <= 0:
+        return 0
+    
+    sessions.sort()
+    for _, session_id in sessions[:excess]:
+        forget_session(session_id)
+        remove_session_dirs(session_id)
+    return excess
+
+_cleanup_lock_file = None
+
+def hold_cleanup_lock():
+    """
+    Return True if this process is the one that sweeps. The first worker to
+    flock CLEANUP_LOCK_PATH keeps it until it exits; the others retry on each
+    tick, so a recycled worker's duty passes to the next one.
+    """
+    global _cleanup_lock_file
+    if _cleanup_lock_file is not None or fcntl is None:
+        return True
+    f = open(CLEANUP_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _cleanup_lock_file = f
+    return True
+
+def start_cleanup_scheduler():
+    """
+    Run cleanup_old_files every CLEANUP_INTERVAL seconds on a daemon timer.
+    Started in each worker (see gunicorn.conf.py), never in the arbiter: a
+    thread there could hold an index lock across a fork. hold_cleanup_lock
+    elects the one worker that actually sweeps.
+    """
+    def run():
+        try:
+            if hold_cleanup_lock():
+                cleanup_old_files()
+        except Exception as e:
+            app.logger.error(f'Scheduled cleanup failed: {e}')
+        finally:
+            schedule()
+    
+    def schedule():
+        timer = threading.Timer(app.config['CLEANUP_INTERVAL'], run)
+        timer.daemon = True
+        timer.start()
+    
+    schedule()
+    app.logger.info(f'Cleanup scheduler started (every {app.config["CLEANUP_INTERVAL"]}s)')
+
+def sweep_session_index():
+    """
+    Evict idle index entries (and their cached processors) in this process,
+    and entries whose files another worker's cleanup has deleted.
+    """
+    now = time.monotonic()
+    with SESSION_INDEX_LOCK:
+        live = list(SESSION_INDEX.items())
+    # stat outside the lock; at most MAX_SESSIONS entries
+    gone = {sid for sid, entry in live if not os.path.exists(entry['original_path'])}
+    with SESSION_INDEX_LOCK:
+        expired = [sid for sid, entry in SESSION_INDEX.items()
+                   if sid in gone or now - entry['ts'] >= SESSION_INDEX_TTL]
+        for sid in expired:
+            del SESSION_INDEX[sid]
+    for sid in expired:
+        drop_processor(sid)
+    
+    # Finished in-process preview jobs whose session is no longer indexed
+    for sid, future in list(PREVIEW_JOBS.items()):
+        if future.done() and sid not in SESSION_INDEX:
+            PREVIEW_JOBS.pop(sid, None)
+    return len(expired)
+
+def start_index_sweeper():
+    """
+    Sweep this process's session index every SESSION_SWEEP_INTERVAL seconds.
+    The index is per worker, so this runs in each one (see gunicorn.conf.py).
+    """
+    def run():
+        while True:
+            time.sleep(app.config['SESSION_SWEEP_INTERVAL'])
+            try:
+                sweep_session_index()
+            except Exception as e:
+                app.logger.error(f'Session index sweep failed: {e}')
+    
+    threading.Thread(target=run, name='ara-index-sweeper', daemon=True).start()
+
+@cached(TTLCache(maxsize=2, ttl=10), lock=threading.Lock())
+def count_session_dirs(folder):
+    """Count session directories in a folder (cached briefly for /health pings)."""
+    with os.scandir(folder) as entries:
+        return sum(1 for entry in entries if entry.is_dir())
+
+def list_entries(folder, limit=20):
+    """Return up to limit entry names from folder without listing all of it."""
+    with os.scandir(folder) as entries:
+        return [entry.name for entry, _ in zip(entries, range(limit))]
+
+# no-transform keeps proxies from re-compressing already-compressed JPEGs.
+# Plain preview URLs revalidate every time (adjustments rewrite the file);
+# URLs carrying ?v=<etag> name one exact version and are cached for good.
+PREVIEW_CACHE_CONTROL = 'no-cache, no-transform'
+PREVIEW_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable, no-transform'
+
+def preview_etag(st):
+    """Short validator derived from a preview's mtime and size."""
+    return hashlib.blake2s(f'{st.st_mtime_ns}-{st.st_size}'.encode()).hexdigest()[:16]
+
+def versioned_preview_url(filename):
+    """Preview URL pinned to the file's current version (plain if missing)."""
+    session_id = filename.split('_', 1)[0]
+    try:
+        st = os.stat(os.path.join(get_session_dirs(session_id)[1], filename))
+    except FileNotFoundError:
+        return f'/preview/{filename}'
+    return f'/preview/{filename}?v={preview_etag(st)}'
+
+def submit_preview_job(original_path, session_id, processed_dir):
+    """Queue preview generation and return a job ID for /preview_status."""
+    if preview_queue is not None:
+        job = preview_queue.enqueue(build_previews, original_path, session_id, processed_dir)
+        return job.id
+    
+    PREVIEW_JOBS[session_id] = IMG_POOL.submit(build_previews, original_path, session_id, processed_dir)
+    return session_id
+
+def get_session_original_filename(session_id):
+    """Return the client's original filename for a session, if known."""
+    entry = get_session_entry(session_id)
+    if entry and entry['original_filename']:
+        return entry['original_filename']
+    if session.get('session_id') == session_id:
+        return session.get('orig_name')
+    return None
+
 # ============================================================================
 # 5. ROUTES
 # ============================================================================
@@ -100,86 +533,188 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Handle file uploads"""
+    """Handle multipart file uploads"""
     app.logger.info('Upload request received')
     
+    # Refuse oversized bodies from the header alone, before any form parsing
+    ok, message = validate_file_size(request.content_length or 0)
+    if not ok:
+        app.logger.warning('File too large: %s', request.remote_addr)
+        return jsonify({'error': message}), 413
+    
     if 'file' not in request.files:
         app.logger.warning('No file in upload request')
         return jsonify({'error': 'No file uploaded'}), 400
     
+    # Thin shim over the streaming path: same chunked, size-capped copy
     file = request.files['file']
+    return accept_upload(file.filename, lambda path: save_stream(file.stream, path))
+
+@app.route('/upload_stream', methods=['POST'])
+def upload_stream():
+    """
+    Handle raw-body uploads (Content-Type: application/octet-stream).
+    The body is copied straight to disk, skipping the multipart parser;
+    the client's filename comes URL-encoded in the X-Filename header.
+    """
+    app.logger.info('Streamed upload request received')
     
-    if file.filename == '':
+    ok, message = validate_file_size(request.content_length or 0)
+    if not ok:
+        app.logger.warning('File too large: %s', request.remote_addr)
+        return jsonify({'error': message}), 413
+    
+    stream = request.stream
+    return accept_upload(unquote(request.headers.get('X-Filename', '')),
+                         lambda path: save_stream(stream, path))
+
+def accept_upload(filename, save):
+    """
+    Validate an upload, save it with save(path) and queue its previews.
+    save must return the number of bytes written.
+    """
+    if not filename:
         app.logger.warning('Empty filename in upload')
         return jsonify({'error': 'No file selected'}), 400
     
-    if not allowed_file(file.filename):
-        app.logger.warning(f'Invalid file type: {file.filename}')
+    if not allowed_file(filename):
+        app.logger.warning('Invalid file type: %s', filename)
         return jsonify({'error': 'File type not allowed. Use JPG, PNG, or TIFF.'}), 400
     
     try:
-        # Check file size
-        file.seek(0, 2)  # Seek to end to get size
-        file_size = file.tell()
-        file.seek(0)  # Reset to beginning
-        
-        if file_size > app.config['MAX_CONTENT_LENGTH']:
-            max_mb = app.config['MAX_CONTENT_LENGTH'] / 1024 / 1024
-            return jsonify({'error': f'File exceeds maximum size of {max_mb}MB'}), 400
-        
-        # Generate session ID
-        session_id = str(uuid.uuid4())
+        # Generate session ID: 72 random bits as hex. No '_' (preview names are
+        # split on it) and short enough to keep every derived path compact.
+        session_id = secrets.token_hex(9)
         session['session_id'] = session_id
         
-        # Save file with session ID prefix
-        original_filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        saved_filename = f"{session_id}_{timestamp}_{original_filename}"
-        original_path = os.path.join(UPLOAD_FOLDER, saved_filename)
-        
-        file.save(original_path)
-        app.logger.info(f'File saved: {saved_filename} ({file_size/1024/1024:.2f}MB)')
+        # Save file into the session's own directory
+        original_filename = secure_filename(filename)
+        ext = os.path.splitext(original_filename)[1].lower()
+        upload_dir, processed_dir = get_session_dirs(session_id)
+        os.makedirs(upload_dir, exist_ok=True)
+        original_path = os.path.join(upload_dir, 'orig' + ext)
+        session['orig_name'] = original_filename
+        session['orig_ext'] = ext
         
-        # Check DPI
-        dpi_warning = check_dpi(original_path)
-        if dpi_warning:
-            app.logger.warning(f'Low DPI detected: {original_filename}')
+        # Byte count from the chunked copy; save_stream enforces the cap
+        file_size = save(original_path)
         
-        # Process previews
-        processor = ImageProcessor(original_path, session_id, PROCESSED_FOLDER)
-        previews = processor.create_previews()
+        # Reject non-images and decompression bombs from the header alone:
+        # Image.open checks the pixel count (see Image.MAX_IMAGE_PIXELS)
+        # without decoding
+        try:
+            with Image.open(original_path):
+                pass
+        except Image.DecompressionBombError as e:
+            remove_session_dirs(session_id)
+            app.logger.warning('Image too large: %s (%s)', original_filename, e)
+            return jsonify({'error': 'Image dimensions too large. Please upload a smaller image.'}), 400
+        except (Image.UnidentifiedImageError, OSError) as e:
+            # Empty or non-image body (the message holds the server path)
+            remove_session_dirs(session_id)
+            app.logger.warning('Not a valid image: %s (%s)', original_filename, e)
+            return jsonify({'error': 'Not a valid image'}), 400
+        remember_session(session_id, original_path, original_filename)
+        app.logger.info('File saved: %s (%.2fMB)', original_path, file_size / 1024 / 1024)
         
-        if not previews:
-            return jsonify({'error': 'Failed to create previews'}), 500
+        # DPI check + previews run in the background; client polls /preview_status
+        job_id = submit_preview_job(original_path, session_id, processed_dir)
+        app.logger.info('Preview job queued: %s', job_id)
         
         response_data = {
             'success': True,
             'session_id': session_id,
             'original_filename': original_filename,
-            'dpi_warning': dpi_warning,
-            'previews': previews
+            'job_id': job_id,
+            'status_url': f'/preview_status/{job_id}',
+            'preview_ext': ImageProcessor.PREVIEW_EXT
         }
         
         # Add warning for large files
         if file_size > 10 * 1024 * 1024:
             response_data['size_warning'] = 'Large file detected. Free tier may have memory limitations.'
         
-        return jsonify(response_data)
+        return jsonify(response_data), 202
         
+    except RequestEntityTooLarge:
+        # Body that ran past the limit mid-copy (see save_stream): drop the
+        # partial file now rather than leaving it for the cleanup sweep
+        remove_session_dirs(session_id)
+        raise
     except Exception as e:
-        app.logger.error(f'Upload error: {str(e)}', exc_info=True)
+        app.logger.warning('Upload error: %s', e, exc_info=app.logger.isEnabledFor(logging.DEBUG))
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+@app.route('/preview_status/<job_id>')
+def preview_status(job_id):
+    """Report progress of a preview job; includes previews once finished"""
+    if not is_valid_session_id(job_id):
+        return jsonify({'error': 'Invalid job ID'}), 400
+    
+    if preview_queue is not None:
+        try:
+            job = Job.fetch(job_id, connection=preview_queue.connection)
+        except Exception:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        status = job.get_status()
+        if status == 'finished':
+            result = job.result
+        elif status == 'failed':
+            return jsonify({'status': 'failed', 'error': 'Failed to create previews'})
+        else:
+            return jsonify({'status': 'pending'})
+    else:
+        # job_id is the session ID; the result file is visible to every worker,
+        # and is kept in the index so repeat polls skip reading it
+        entry = get_session_entry(job_id)
+        result = entry['previews'] if entry else None
+        if result is None:
+            result = load_preview_result(job_id, get_session_dirs(job_id)[1])
+            if result is not None and entry:
+                entry['previews'] = result
+        if result is not None and result.get('status') == 'failed':
+            # Marker written by whichever worker ran the job
+            PREVIEW_JOBS.pop(job_id, None)
+            app.logger.error('Preview job failed: %s', result.get('error'))
+            return jsonify({'status': 'failed', 'error': 'Failed to create previews'})
+        if result is None:
+            future = PREVIEW_JOBS.get(job_id)
+            if future is not None and future.done() and future.exception():
+                PREVIEW_JOBS.pop(job_id, None)
+                app.logger.error('Preview job failed: %s', future.exception())
+                return jsonify({'status': 'failed', 'error': 'Failed to create previews'})
+            if future is None and not get_session_original_path(job_id):
+                return jsonify({'error': 'Job not found'}), 404
+            return jsonify({'status': 'pending'})
+        PREVIEW_JOBS.pop(job_id, None)
+    
+    if not result or not result.get('previews'):
+        return jsonify({'status': 'failed', 'error': 'Failed to create previews'})
+    
+    return jsonify({
+        'status': 'finished',
+        'success': True,
+        'dpi_warning': result['dpi_warning'],
+        'previews': {
+            ratio: dict(info, url=versioned_preview_url(info['url'].rsplit('/', 1)[1])) if 'url' in info else info
+            for ratio, info in result['previews'].items()
+        }
+    })
+
 @app.route('/adjust', methods=['POST'])
 def adjust_crop():
     """Adjust crop position with proper preview handling"""
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({'error': 'Invalid JSON'}), 400
     session_id = data.get('session_id')
     ratio = data.get('ratio')
     x_offset = data.get('x_offset', 0)
     y_offset = data.get('y_offset', 0)
     
-    app.logger.info(f'Adjust request: session={session_id}, ratio={ratio}, x={x_offset}, y={y_offset}')
+    app.logger.info('Adjust request: session=%s, ratio=%s, x=%s, y=%s',
+                    session_id, ratio, x_offset, y_offset)
     
     if not session_id or not ratio:
         return jsonify({'error': 'Missing parameters'}), 400
@@ -188,19 +723,20 @@ def adjust_crop():
     original_path = get_session_original_path(session_id)
     
     if not original_path or not os.path.exists(original_path):
-        app.logger.warning(f'Original file not found for session: {session_id}')
+        app.logger.warning('Original file not found for session: %s', session_id)
         return jsonify({'error': 'File not found. Please upload again.'}), 404
     
     try:
-        processor = ImageProcessor(original_path, session_id, PROCESSED_FOLDER)
-        preview_filename = processor.adjust_crop(ratio, x_offset, y_offset)
+        processed_dir = get_session_dirs(session_id)[1]
+        processor = get_processor(session_id, original_path, processed_dir)
+        preview_filename = IMG_POOL.submit(processor.adjust_crop, ratio, x_offset, y_offset).result()
         
         if preview_filename:
-            app.logger.info(f'Adjustment saved successfully: {preview_filename}')
+            app.logger.info('Adjustment saved successfully: %s', preview_filename)
             
             # CRITICAL: Return the correct preview URL
             # This should match what the /preview/<filename> endpoint expects
-            preview_url = f'/preview/{preview_filename}'
+            preview_url = versioned_preview_url(preview_filename)
             
             return jsonify({
                 'success': True,
@@ -208,11 +744,11 @@ def adjust_crop():
                 'preview_filename': preview_filename  # For debugging
             })
         else:
-            app.logger.error(f'Adjustment failed: processor returned None for {ratio}')
+            app.logger.error('Adjustment failed: processor returned None for %s', ratio)
             return jsonify({'error': 'Adjustment failed - could not create preview'}), 500
             
     except Exception as e:
-        app.logger.error(f'Adjustment error: {str(e)}', exc_info=True)
+        app.logger.warning('Adjustment error: %s', e, exc_info=app.logger.isEnabledFor(logging.DEBUG))
         return jsonify({'error': f'Adjustment failed: {str(e)}'}), 500
 
 @app.route('/preview/<filename>')
@@ -222,37 +758,78 @@ def get_preview(filename):
     if '..' in filename or filename.startswith('/'):
         return jsonify({'error': 'Invalid filename'}), 400
     
-    preview_path = os.path.join(PROCESSED_FOLDER, filename)
+    # Preview filenames are prefixed with their session ID
+    session_id = filename.split('_', 1)[0]
+    if not is_valid_session_id(session_id):
+        return jsonify({'error': 'Invalid filename'}), 400
     
-    # Debug logging
-    app.logger.info(f"Preview request: {filename}")
-    app.logger.info(f"Looking in: {PROCESSED_FOLDER}")
-    app.logger.info(f"Full path: {preview_path}")
-    app.logger.info(f"File exists: {os.path.exists(preview_path)}")
+    # Path comes from the name alone (no lookup); the index touch just keeps
+    # a session whose previews are being viewed from expiring
+    get_session_entry(session_id)
+    processed_dir = get_session_dirs(session_id)[1]
+    preview_path = os.path.join(processed_dir, filename)
+    debug = app.logger.isEnabledFor(logging.DEBUG)
     
-    if os.path.exists(preview_path):
-        app.logger.info(f"Serving preview: {filename} ({os.path.getsize(preview_path)} bytes)")
-        return send_file(preview_path, mimetype='image/jpeg', max_age=300)
-    else:
-        # List available previews for debugging
-        try:
-            available_files = os.listdir(PROCESSED_FOLDER)
-            preview_files = [f for f in available_files if f.endswith(('.jpg', '.jpeg', '.png'))]
-            app.logger.warning(f"Preview not found: {filename}")
-            app.logger.warning(f"Available previews: {preview_files[:10]}")
-        except Exception as e:
-            app.logger.error(f"Error listing files: {e}")
-        
+    if debug:
+        app.logger.debug(f"Preview request: {filename}")
+        app.logger.debug(f"Full path: {preview_path}")
+    
+    # One stat serves as both the existence check and the size
+    try:
+        st = os.stat(preview_path)
+    except FileNotFoundError:
+        if debug:
+            # List available previews for debugging
+            try:
+                with os.scandir(processed_dir) as entries:
+                    preview_files = [e.name for e in entries
+                                     if e.name.endswith(('.webp', '.jpg', '.jpeg', '.png'))]
+                app.logger.debug(f"Available previews: {preview_files[:10]}")
+            except FileNotFoundError:
+                app.logger.debug("Available previews: []")
+            except Exception as e:
+                app.logger.debug(f"Error listing files: {e}")
+        app.logger.warning('Preview not found: %s', filename)
         return jsonify({'error': f'Preview not found: {filename}'}), 404
+    
+    if debug:
+        app.logger.debug(f"Serving preview: {filename} ({st.st_size} bytes)")
+    
+    # Adjustments rewrite previews in place, so clients revalidate every time;
+    # a matching ETag is answered from the stat alone, without opening the file
+    etag = preview_etag(st)
+    cache_control = PREVIEW_IMMUTABLE_CACHE_CONTROL if request.args.get('v') == etag else PREVIEW_CACHE_CONTROL
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': cache_control})
+    
+    # WebP previews, or JPEG where Pillow lacks libwebp (ImageProcessor.PREVIEW_FORMAT)
+    mimetype = 'image/webp' if filename.endswith('.webp') else 'image/jpeg'
+    
+    accel_prefix = app.config['ACCEL_REDIRECT_PREFIX']
+    if accel_prefix:
+        # nginx does the sendfile(2); this worker is freed immediately
+        response = Response(status=200, mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{session_id}/{filename}"
+        response.headers['ETag'] = f'"{etag}"'
+        response.headers['Cache-Control'] = cache_control
+        return response
+    
+    # Served through the WSGI file wrapper (sendfile(2) under gunicorn)
+    response = send_from_directory(processed_dir, filename, mimetype=mimetype,
+                                   conditional=True, etag=etag, last_modified=st.st_mtime)
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 @app.route('/download', methods=['POST'])
 def download_all():
     """Process all ratios and return ZIP file"""
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({'error': 'Invalid JSON'}), 400
     session_id = data.get('session_id')
     adjustments = data.get('adjustments', {})
     
-    app.logger.info(f'Download request for session: {session_id}')
+    app.logger.info('Download request for session: %s', session_id)
     
     if not session_id:
         return jsonify({'error': 'Session ID required'}), 400
@@ -260,105 +837,120 @@ def download_all():
     # Find original file
     original_path = get_session_original_path(session_id)
     
-    if not original_path:
+    # The index may outlive the files: the cap sweep deletes the oldest
+    # sessions even when another worker still has them indexed
+    if not original_path or not os.path.exists(original_path):
+        app.logger.warning('Original file not found for session: %s', session_id)
         return jsonify({'error': 'Original file not found. Please upload again.'}), 404
     
-    # Extract original filename from the saved file
-    original_filename = None
-    for file in os.listdir(UPLOAD_FOLDER):
-        if file.startswith(session_id):
-            # Extract original name (remove session_id_timestamp_ prefix)
-            parts = file.split('_', 2)
-            if len(parts) >= 3:
-                original_filename = parts[2]
-            else:
-                original_filename = file
-            break
-    
+    original_filename = get_session_original_filename(session_id)
     if not original_filename:
         original_filename = f"image_{session_id[:8]}"
     
+    base_name = os.path.splitext(original_filename)[0]
+    clean_base_name = clean_filename(base_name)
+    processed_dir = get_session_dirs(session_id)[1]
+    output_dir = None
+    
     try:
-        # Process all images with adjustments
-        processor = ImageProcessor(original_path, session_id, PROCESSED_FOLDER)
-        output_files = processor.process_all_ratios(adjustments)
+        # Process all ratios concurrently on the shared image pool, all
+        # cropping from the session's one decoded source
+        processor = get_processor(session_id, original_path, processed_dir)
+        
+        # Every download renders the same file names, so each request gets its
+        # own directory: a second download for the session must not overwrite
+        # or delete files this one is still streaming
+        output_dir = tempfile.mkdtemp(dir=processed_dir)
+        output_files = processor.process_all_ratios(adjustments, clean_base_name or None, IMG_POOL,
+                                                    output_dir)
         
         if not output_files:
             app.logger.error('No output files generated')
+            shutil.rmtree(output_dir, ignore_errors=True)
             return jsonify({'error': 'Failed to process images'}), 500
         
-        # Add Printing_Guide.pdf
-        pdf_path = os.path.join('static', 'Printing_Guide.pdf')
-        if os.path.exists(pdf_path):
-            output_files.append(pdf_path)
-        else:
-            app.logger.warning('Printing_Guide.pdf not found in static folder')
-        
         # Create ZIP file with naming: OriginalName_printready.zip
-        base_name = os.path.splitext(original_filename)[0]
-        clean_base_name = clean_filename(base_name)
         zip_filename = f"{clean_base_name}_printready.zip"
         
         # Ensure ZIP filename is valid
         if not zip_filename or zip_filename == '_printready.zip':
             zip_filename = f"aspect_ratios_{session_id[:8]}.zip"
         
-        zip_path = os.path.join(PROCESSED_FOLDER, zip_filename)
+        # Stream the ZIP straight to the client (no intermediate file on disk).
+        # Members are STORED: the JPEG outputs are already entropy-coded and
+        # deflating them costs CPU for <1% gain. Stored members also let the
+        # stream report its size up front for Content-Length.
+        zs = ZipStream(compress_type=ZIP_STORED, sized=True)
+        for file_path in output_files:
+            arcname = os.path.basename(file_path)
+            zs.add_path(file_path, arcname)
+            app.logger.info('Added to ZIP: %s', arcname)
         
-        # Create ZIP with compression
-        try:
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for file_path in output_files:
-                    if os.path.exists(file_path):
-                        arcname = os.path.basename(file_path)
-                        zipf.write(file_path, arcname)
-                        app.logger.info(f'Added to ZIP: {arcname}')
-            
-            # Verify ZIP was created
-            if not os.path.exists(zip_path):
-                app.logger.error(f'ZIP file not created: {zip_path}')
-                return jsonify({'error': 'Failed to create ZIP file'}), 500
-                
-            zip_size = os.path.getsize(zip_path)
-            app.logger.info(f'ZIP created: {zip_filename} ({zip_size/1024/1024:.2f}MB)')
-            
-        except Exception as e:
-            app.logger.error(f'ZIP creation error: {str(e)}', exc_info=True)
-            return jsonify({'error': f'ZIP creation failed: {str(e)}'}), 500
+        # Add Printing_Guide.pdf from memory
+        if PRINTING_GUIDE_BYTES is not None:
+            zs.add(PRINTING_GUIDE_BYTES, 'Printing_Guide.pdf')
+        else:
+            app.logger.warning('Printing_Guide.pdf not found in static folder')
+        
+        zip_size = len(zs)
+        app.logger.info('Streaming ZIP: %s (%.2fMB)', zip_filename, zip_size / 1024 / 1024)
+        
+        def stream():
+            # Outputs are regenerated on every download; reclaim /tmp as soon
+            # as the last byte leaves (or the client disconnects)
+            try:
+                yield from zs
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
         
-        # Send file with new naming
-        return send_file(
-            zip_path,
-            as_attachment=True,
-            download_name=zip_filename,
-            mimetype='application/zip'
+        return Response(
+            stream(),
+            mimetype='application/zip',
+            headers={
+                'Content-Disposition': f'attachment; filename="{zip_filename}"',
+                'Content-Length': str(zip_size)
+            }
         )
         
+    except FileNotFoundError as e:
+        # Session deleted between the check above and rendering
+        if output_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        app.logger.warning('Download error: %s', e)
+        return jsonify({'error': 'Original file not found. Please upload again.'}), 404
     except Exception as e:
-        app.logger.error(f'Download error: {str(e)}', exc_info=True)
-        return jsonify({'error': f'Download failed: {str(e)}'}), 500
+        if output_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        # Details stay in the log: exception text can carry server paths
+        app.logger.warning('Download error: %s', e, exc_info=app.logger.isEnabledFor(logging.DEBUG))
+        return jsonify({'error': 'Download failed'}), 500
 
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
-    upload_count = len([f for f in os.listdir(UPLOAD_FOLDER) if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))])
-    processed_count = len([f for f in os.listdir(PROCESSED_FOLDER) if os.path.isfile(os.path.join(PROCESSED_FOLDER, f))])
+    upload_count = count_session_dirs(UPLOAD_FOLDER)
+    processed_count = count_session_dirs(PROCESSED_FOLDER)
     
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'upload_dir': os.path.exists(UPLOAD_FOLDER),
         'processed_dir': os.path.exists(PROCESSED_FOLDER),
+        'upload_sessions': upload_count,
+        'processed_sessions': processed_count,
+        # Pre-session-directory names, kept for existing monitors: each
+        # session is now one directory, so these count sessions too
         'upload_files': upload_count,
         'processed_files': processed_count,
+        'active_sessions': len(SESSION_INDEX),  # this worker's index, no I/O
         'max_file_size_mb': app.config['MAX_CONTENT_LENGTH'] / 1024 / 1024
     })
 
 @app.route('/debug')
 def debug_info():
     """Debug endpoint to see what files exist"""
-    upload_files = os.listdir(UPLOAD_FOLDER)[:20]
-    processed_files = os.listdir(PROCESSED_FOLDER)[:20]
+    upload_files = list_entries(UPLOAD_FOLDER)
+    processed_files = list_entries(PROCESSED_FOLDER)
     
     return jsonify({
         'upload_folder': UPLOAD_FOLDER,
@@ -371,29 +963,28 @@ def debug_info():
 @app.route('/cleanup', methods=['POST'])
 def cleanup_session():
     """Clean up files for a specific session"""
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({'error': 'Invalid JSON'}), 400
     session_id = data.get('session_id')
     
     if not session_id:
         return jsonify({'error': 'Session ID required'}), 400
     
-    app.logger.info(f'Cleanup requested for session: {session_id}')
+    if not is_valid_session_id(session_id):
+        return jsonify({'error': 'Invalid session ID'}), 400
     
-    files_removed = 0
+    app.logger.info('Cleanup requested for session: %s', session_id)
     
-    # Clean up files in both folders
-    for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER]:
-        if os.path.exists(folder):
-            for file in os.listdir(folder):
-                if file.startswith(session_id):
-                    try:
-                        os.remove(os.path.join(folder, file))
-                        files_removed += 1
-                    except Exception as e:
-                        app.logger.warning(f'Could not remove {file}: {e}')
+    forget_session(session_id)
+    PREVIEW_JOBS.pop(session_id, None)
+    
+    # Each session owns one directory in both folders
+    dirs_removed = remove_session_dirs(session_id)
     
-    app.logger.info(f'Cleanup completed: {files_removed} files removed')
-    return jsonify({'success': True, 'files_removed': files_removed})
+    app.logger.info('Cleanup completed: %d session directories removed', dirs_removed)
+    # files_removed: the old name for the same count, kept for existing clients
+    return jsonify({'success': True, 'dirs_removed': dirs_removed, 'files_removed': dirs_removed})
 
 # ============================================================================
 # 6. ERROR HANDLERS
@@ -402,20 +993,20 @@ def cleanup_session():
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
-    app.logger.warning(f'404 error: {request.url}')
+    app.logger.warning('404 error: %s', request.url)
     return jsonify({'error': 'Resource not found'}), 404
 
 @app.errorhandler(413)
 def too_large(error):
     """Handle file too large errors"""
-    app.logger.warning(f'File too large: {request.remote_addr}')
+    app.logger.warning('File too large: %s', request.remote_addr)
     max_mb = app.config['MAX_CONTENT_LENGTH'] / 1024 / 1024
     return jsonify({'error': f'File size exceeds {max_mb}MB limit'}), 413
 
 @app.errorhandler(500)
 def internal_error(error):
     """Handle internal server errors"""
-    app.logger.error(f'500 error: {str(error)}', exc_info=True)
+    app.logger.exception('500 error: %s', error)
     return jsonify({'error': 'Internal server error'}), 500
 
 # ============================================================================
@@ -435,10 +1026,12 @@ if __name__ == '__main__':
     is_production = os.environ.get('FLASK_ENV') == 'production'
     
     if is_production:
-        # Production: Use all network interfaces
-        app.logger.info(f'Starting production server on port {port}')
-        app.run(host='0.0.0.0', port=port)
+        # Production: the Flask dev server serializes requests; use gunicorn
+        app.logger.error('Production mode: start with "gunicorn app:app" (see gunicorn.conf.py)')
+        raise SystemExit(1)
     else:
         # Development: Localhost with debug
         app.logger.info(f'Starting development server on port {port}')
+        start_cleanup_scheduler()
+        start_index_sweeper()
         app.run(host='127.0.0.1', port=port, debug=True)
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Gunicorn configuration for Aspect-Ratio Automator
+Picked up automatically by `gunicorn app:app` (see Procfile)
+"""
+
+import os
+
+# Bind to Render's assigned port
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Each worker brings its own image pool, warm processors and Pillow block
+# cache, so size workers for memory, not cores (os.cpu_count() reports the
+# host's cores inside containers). ARA_WORKERS, else gunicorn's usual
+# WEB_CONCURRENCY, else 2. Threads cover slow clients and preview fetches
+# (Pillow releases the GIL, so gthread parallelizes the image work too).
+workers = max(1, int(os.environ.get('ARA_WORKERS') or os.environ.get('WEB_CONCURRENCY') or 2))
+threads = max(1, int(os.environ.get('ARA_THREADS', 4)))
+worker_class = 'gthread'
+
+# Image processing can exceed gunicorn's 30s default
+timeout = 120
+
+# Recycle workers periodically to cap RSS creep from repeated Pillow decodes;
+# jitter keeps them from all restarting at once
+max_requests = 200
+max_requests_jitter = 50
+
+# Serve /preview files through wsgi.file_wrapper with os.sendfile rather than
+# copying them through Python (gunicorn only falls back when unsupported)
+sendfile = True
+
+# Import app (Pillow, ImageProcessor) once in the master; workers share it via COW
+preload_app = True
+
+
+def post_fork(server, worker):
+    """
+    Each worker keeps its own session index; start its idle sweeper and the
+    file cleaner (one elected worker sweeps, see hold_cleanup_lock). The
+    arbiter stays thread-free, so no fork can copy a held lock.
+    """
+    from app import start_cleanup_scheduler, start_index_sweeper
+    start_index_sweeper()
+    start_cleanup_scheduler()
@@ -7,6 +7,7 @@
 let currentSession = null;
 let currentAdjustments = {};
 let currentRatio = null;
+let previewExt = 'jpg';  // 'webp' when the server encodes WebP previews
 
 // DOM Elements
 const uploadZone = document.getElementById('uploadZone');
@@ -89,22 +90,31 @@ async function handleFile(file) {
     
     showLoading();
     
-    const formData = new FormData();
-    formData.append('file', file);
-    
     try {
-        const response = await fetch('/upload', {
+        // Raw body upload: the server writes it straight to disk
+        const response = await fetch('/upload_stream', {
             method: 'POST',
-            body: formData
+            headers: {
+                'Content-Type': 'application/octet-stream',
+                'X-Filename': encodeURIComponent(file.name)
+            },
+            body: file
         });
         
-        const data = await response.json();
+        let data = await response.json();
         
         if (data.success) {
             console.log('Upload successful:', data);
             
+            // Previews are generated in the background; wait for them
+            const previewData = await waitForPreviews(data.status_url);
+            data = { ...data, ...previewData };
+        }
+        
+        if (data.success) {
             currentSession = data.session_id;
             currentAdjustments = {};
+            previewExt = data.preview_ext || 'jpg';
             
             // Save session to localStorage
             saveSessionToStorage();
@@ -141,6 +151,29 @@ async function handleFile(file) {
     }
 }
 
+/**
+ * Poll the preview job until it finishes (or fails / times out)
+ */
+async function waitForPreviews(statusUrl, intervalMs = 500, timeoutMs = 120000) {
+    const deadline = Date.now() + timeoutMs;
+    
+    while (Date.now() < deadline) {
+        const response = await fetch(statusUrl);
+        const data = await response.json();
+        
+        if (data.status === 'finished') {
+            return data;
+        }
+        if (data.status === 'failed' || !response.ok) {
+            return { success: false, error: data.error || 'Failed to create previews' };
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+    
+    return { success: false, error: 'Timed out waiting for previews' };
+}
+
 // ============================================================================
 // 3. PREVIEW GRID MANAGEMENT
 // ============================================================================
@@ -231,13 +264,11 @@ function openAdjustment(ratio) {
     
     if (previewImg && previewImg.src) {
         // Use cache busting to ensure fresh image
-        const timestamp = new Date().getTime();
-        const separator = previewImg.src.includes('?') ? '&' : '?';
-        modalImage.src = previewImg.src + separator + 't=' + timestamp;
+        modalImage.src = cacheBusted(previewImg.src);
         console.log('Set modal image to:', modalImage.src);
     } else {
         // Fallback: try to load from server
-        modalImage.src = `/preview/${currentSession}_${ratio}_preview.jpg?t=${Date.now()}`;
+        modalImage.src = `/preview/${currentSession}_${ratio}_preview.${previewExt}?t=${Date.now()}`;
         console.log('Using fallback modal image:', modalImage.src);
     }
     
@@ -291,10 +322,10 @@ function resetAdjustment() {
     
     // Reload original preview
     const modalImage = document.getElementById('modalImage');
-    modalImage.src = `/preview/${currentSession}_${currentRatio}_preview.jpg?t=${Date.now()}`;
+    modalImage.src = `/preview/${currentSession}_${currentRatio}_preview.${previewExt}?t=${Date.now()}`;
     
     // Update grid preview
-    updateGridPreview(currentRatio, `/preview/${currentSession}_${currentRatio}_preview.jpg`);
+    updateGridPreview(currentRatio, `/preview/${currentSession}_${currentRatio}_preview.${previewExt}`);
     
     showToast('Adjustment reset to center', 'info');
     console.log('Adjustment reset for', currentRatio);
@@ -349,9 +380,9 @@ async function saveAdjustment() {
             // Save to localStorage
             saveSessionToStorage();
             
-            // Update grid preview with cache busting
+            // Update grid preview (the URL is versioned, so no cache busting)
             if (data.preview_url) {
-                const previewUrl = data.preview_url + '?t=' + Date.now();
+                const previewUrl = cacheBusted(data.preview_url);
                 updateGridPreview(currentRatio, previewUrl);
                 
                 // Also update modal image
@@ -359,7 +390,7 @@ async function saveAdjustment() {
             } else {
                 console.warn('No preview_url in response:', data);
                 // Fallback to session-based URL
-                const fallbackUrl = `/preview/${currentSession}_${currentRatio}_preview.jpg?t=${Date.now()}`;
+                const fallbackUrl = `/preview/${currentSession}_${currentRatio}_preview.${previewExt}?t=${Date.now()}`;
                 updateGridPreview(currentRatio, fallbackUrl);
                 modalImage.src = fallbackUrl;
             }
@@ -383,6 +414,19 @@ async function saveAdjustment() {
     }
 }
 
+/**
+ * Add a cache-busting parameter unless the URL is already versioned (?v=),
+ * in which case it names one exact file and the browser cache is safe
+ */
+function cacheBusted(url) {
+    const query = url.split('?')[1] || '';
+    if (new URLSearchParams(query).has('v')) {
+        return url;
+    }
+    const separator = url.includes('?') ? '&' : '?';
+    return url + separator + 't=' + Date.now();
+}
+
 /**
  * Update preview image in the grid
  */
@@ -403,8 +447,7 @@ function updateGridPreview(ratio, previewUrl) {
         const oldSrc = img.src;
         
         // Update src with cache busting
-        const separator = previewUrl.includes('?') ? '&' : '?';
-        img.src = previewUrl + separator + 't=' + Date.now();
+        img.src = cacheBusted(previewUrl);
         
         // Handle loading
         img.style.opacity = '0.7';
@@ -1,6 +1,10 @@
 # utils/dpi_checker.py - Updated
+import logging
+
 from PIL import Image
 
+logger = logging.getLogger(__name__)
+
 def check_dpi(image_path):
     """Check DPI of image and return warning if needed"""
     try:
@@ -18,5 +22,5 @@ def check_dpi(image_path):
             
             return None
     except Exception as e:
-        print(f"Error checking DPI: {e}")
+        logger.warning("Error checking DPI: %s", e)
         return None
\ No newline at end of file
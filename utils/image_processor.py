@@ -4,10 +4,35 @@ Optimized for Render.com free tier (512MB RAM limit)
 FIXED: Preview images not showing after adjustments
 """
 
-from PIL import Image, ImageOps
+from PIL import Image, ImageOps, features
+import io
+import logging
+import math
 import os
+import re
+import threading
 from datetime import datetime
-import traceback
+from collections import OrderedDict
+
+# Characters kept in output filenames (same rule as app.clean_filename)
+_FILENAME_CLEAN_RE = re.compile(r'[^\w\s\-_.]')
+
+# Pillow allocates image memory in 16MB blocks and by default returns every
+# freed block to the OS, so each full-size crop/resize re-mmaps its buffers.
+# Keep a few freed blocks pooled for reuse by the next request. 4 blocks caps
+# the pool at 64MB on the free tier; PILLOW_BLOCKS_MAX overrides it.
+if 'PILLOW_BLOCKS_MAX' not in os.environ:
+    Image.core.set_blocks_max(4)
+
+# Optional libvips backend for the final renders (ARA_IMAGE_BACKEND=vips,
+# needs pyvips + libvips): decode, crop, resize and encode stream through in
+# tiles, so a full-size source is never held in memory. Default: Pillow.
+if os.environ.get('ARA_IMAGE_BACKEND', 'pillow').lower() == 'vips':
+    import pyvips
+else:
+    pyvips = None
+
+logger = logging.getLogger(__name__)
 
 class ImageProcessor:
     """
@@ -30,6 +55,21 @@ class ImageProcessor:
     MAX_SOURCE_DIMENSION = 6000  # Don't process source images larger than this
     MAX_MEMORY_SAFE_DIMENSION = 8000  # Absolute limit
     
+    # Longest side of the web previews, in pixels
+    PREVIEW_SIZE = 300
+    
+    # Previews resample with BICUBIC: at 300px the difference from LANCZOS
+    # is invisible and the filter is half as wide. Print outputs keep LANCZOS.
+    PREVIEW_RESAMPLE = Image.Resampling.BICUBIC
+    
+    # Web previews are WebP (about half the bytes of the JPEG equivalent)
+    # when Pillow has libwebp, JPEG otherwise
+    PREVIEW_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+    PREVIEW_EXT = 'webp' if PREVIEW_FORMAT == 'WEBP' else 'jpg'
+    
+    # Encoded adjust_crop previews kept per processor, keyed by offsets
+    ADJUST_CACHE_SIZE = 50
+    
     def __init__(self, image_path, session_id, processed_folder='processed'):
         """
         Initialize image processor with memory optimization.
@@ -49,7 +89,22 @@ class ImageProcessor:
         # Load image metadata only (not full image) to check dimensions
         self.image_info = self._get_image_info()
         
-        print(f"ImageProcessor initialized: {os.path.basename(image_path)}, session: {session_id[:8]}")
+        # Decoded, size-capped source; loaded on first use, shared by every
+        # ratio of the downloads in flight and dropped once none are left
+        self._source = None
+        self._source_lock = threading.Lock()
+        # process_all_ratios calls in flight; the source is kept while any are
+        self._source_users = 0
+        
+        # ratio -> source scaled so that ratio's crop is preview-sized;
+        # adjust_crop previews are then just a small crop + encode
+        self._preview_bases = {}
+        
+        # (ratio, x_offset, y_offset) -> encoded preview, LRU; moving a slider
+        # back to an offset seen before just rewrites the cached bytes
+        self._adjust_cache = OrderedDict()
+        
+        logger.debug("ImageProcessor initialized: %s, session: %s", os.path.basename(image_path), session_id[:8])
         
     def _get_image_info(self):
         """Get image dimensions without loading full image into memory."""
@@ -63,97 +118,282 @@ class ImageProcessor:
                     'dpi': img.info.get('dpi', (72, 72))
                 }
         except Exception as e:
-            print(f"Error getting image info: {e}")
+            logger.warning("Error getting image info: %s", e)
             return None
     
+    def _get_source(self):
+        """
+        Return the decoded source image (after _resize_if_too_large).
+        Callers must treat it as read-only: crop/resize return new images.
+        """
+        with self._source_lock:
+            if self._source is None:
+                with Image.open(self.image_path) as img:
+                    # The cap depends on the crops' aspect, so size it from
+                    # the image as displayed (after EXIF orientation)
+                    limit = self._source_limit(*self._oriented_size(img))
+                    if limit:
+                        # JPEG: let libjpeg decode at 1/2..1/8 scale as long as
+                        # the result still covers the size it is capped to below
+                        full_size = img.size
+                        scale = limit / max(full_size)
+                        img.draft(img.mode, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+                        if img.size != full_size:
+                            logger.debug("Draft decode: %sx%s -> %sx%s (1/%s scale)",
+                                         full_size[0], full_size[1], img.width, img.height,
+                                         round(full_size[0] / img.width))
+                    
+                    # Apply EXIF orientation so crops match what the user sees
+                    source = self._to_output_mode(ImageOps.exif_transpose(img))
+                self._source = self._resize_if_too_large(source, limit)
+                if self._source is not source:
+                    # Free the full decode now rather than when this frame exits
+                    source.close()
+            return self._source
+    
+    def _oriented_size(self, img):
+        """(width, height) of an opened image once its EXIF orientation is applied."""
+        # Orientations 5-8 turn the image a quarter turn
+        if img.getexif().get(0x0112) in (5, 6, 7, 8):
+            return img.height, img.width
+        return img.size
+    
+    def _to_output_mode(self, image):
+        """
+        Convert a freshly decoded source to the output mode once: CMYK stays
+        CMYK, anything else becomes RGB. Renders then need no per-ratio
+        convert, and palette/16-bit sources get LANCZOS instead of NEAREST
+        (or an error). The original is closed if converted.
+        """
+        if image.mode in ('RGB', 'CMYK'):
+            return image
+        converted = image.convert('RGB')
+        image.close()
+        return converted
+    
+    def _get_preview_base(self, ratio):
+        """Return the (cached) preview-scale copy of the source for a ratio."""
+        base = self._preview_bases.get(ratio)
+        if base is not None:
+            return base
+        
+        # The work image covers every crop at preview size (see
+        # _load_preview_source), so the full-size source is never needed
+        source = self._load_work_image()
+        width, height = self.RATIOS[ratio]
+        crop_width, crop_height = self._crop_dimensions(source.width, source.height, width, height)
+        
+        # Offsets are a percentage of the crop size, so cropping this copy
+        # gives the same framing as cropping the full-size source
+        scale = self._preview_scale(crop_width, crop_height)
+        base_size = (max(1, round(source.width * scale)), max(1, round(source.height * scale)))
+        base = source.resize(base_size, self.PREVIEW_RESAMPLE, reducing_gap=3.0)
+        source.close()
+        
+        with self._source_lock:
+            return self._preview_bases.setdefault(ratio, base)
+    
+    def _work_image_path(self):
+        """Where create_previews persists its decoded preview source."""
+        return os.path.join(self.processed_folder, f"{self.session_id}_work.png")
+    
+    def _save_work_image(self, source):
+        """
+        Persist the preview source so processors created later (another
+        worker, or after the warm copy was dropped) build their adjust
+        previews from it instead of decoding the original again. Removed
+        with the session's processed directory.
+        """
+        if source.mode != 'RGB':
+            # PNG can't hold CMYK; those sessions decode the original
+            return
+        # Non-JPEG sources aren't drafted; box-shrink those, keeping the
+        # short side at least twice the preview size
+        factor = min(source.size) // (self.PREVIEW_SIZE * 2)
+        work = source.reduce(factor) if factor >= 2 else source
+        work_path = self._work_image_path()
+        try:
+            # Write then rename so readers never see a partial file
+            work.save(work_path + '.tmp', 'PNG', compress_level=1)
+            os.replace(work_path + '.tmp', work_path)
+        except OSError as e:
+            logger.warning("Could not save work image: %s", e)
+        finally:
+            if work is not source:
+                work.close()
+    
+    def _load_work_image(self):
+        """Return the persisted preview source, decoding it again if missing."""
+        try:
+            work = Image.open(self._work_image_path())
+            work.load()
+            return work
+        except OSError:
+            return self._load_preview_source()
+    
+    def _preview_scale(self, crop_width, crop_height):
+        """Factor that fits a crop within PREVIEW_SIZE (never enlarges)."""
+        return min(1.0, self.PREVIEW_SIZE / max(crop_width, crop_height))
+    
+    def close(self):
+        """
+        Drop the cached source images; the next use decodes again. They are
+        not closed: a request still rendering from them keeps its reference,
+        and they are freed afterwards.
+        """
+        with self._source_lock:
+            self._source = None
+            self._preview_bases = {}
+            self._adjust_cache.clear()
+    
     def create_previews(self):
         """Create preview images for all ratios (memory optimized)."""
         previews = {}
         
-        print(f"Creating previews for session: {self.session_id[:8]}")
+        logger.debug("Creating previews for session: %s", self.session_id[:8])
         
-        for ratio_name, (width, height) in self.RATIOS.items():
-            try:
-                # CRITICAL: Use consistent naming convention
-                preview_filename = f"{self.session_id}_{ratio_name}_preview.jpg"
-                preview_path = os.path.join(self.processed_folder, preview_filename)
-                
-                print(f"Creating preview for {ratio_name} at {preview_path}")
-                
-                # Create preview with memory optimization
-                preview = self._create_crop_for_preview(width, height)
-                if preview:
-                    # Resize for web display (small thumbnail)
-                    preview.thumbnail((300, 300), Image.Resampling.LANCZOS)
+        # Decode once (draft-scaled for JPEGs) and crop every ratio from it
+        try:
+            source = self._load_preview_source()
+        except Exception as e:
+            logger.exception("Error loading preview source: %s", e)
+            return {
+                ratio_name: {'error': str(e), 'dimensions': f"{width} x {height} px"}
+                for ratio_name, (width, height) in self.RATIOS.items()
+            }
+        self._save_work_image(source)
+        
+        try:
+            for ratio_name, (width, height) in self.RATIOS.items():
+                try:
+                    # CRITICAL: Use consistent naming convention
+                    preview_filename = f"{self.session_id}_{ratio_name}_preview.{self.PREVIEW_EXT}"
+                    preview_path = os.path.join(self.processed_folder, preview_filename)
                     
-                    # Save with optimization
-                    preview.save(
-                        preview_path, 
-                        'JPEG', 
-                        quality=85, 
-                        optimize=True,
-                        progressive=True  # Progressive JPEG for faster loading
-                    )
+                    logger.debug("Creating preview for %s at %s", ratio_name, preview_path)
                     
-                    # Verify file was created
-                    if os.path.exists(preview_path):
-                        file_size = os.path.getsize(preview_path) / 1024
-                        print(f"Preview created: {preview_filename} ({file_size:.1f} KB)")
+                    # Crop already has the target aspect ratio
+                    box = self._calculate_crop(source, width, height)
+                    if box:
+                        # Straight from the crop box to web thumbnail size in
+                        # one resample (box pre-shrink + BICUBIC), no crop copy
+                        left, top, right, bottom = box
+                        scale = self._preview_scale(right - left, bottom - top)
+                        preview_size = (max(1, round((right - left) * scale)),
+                                        max(1, round((bottom - top) * scale)))
+                        preview = source.resize(preview_size, self.PREVIEW_RESAMPLE,
+                                                box=box, reducing_gap=3.0)
+                        self._save_preview(preview, preview_path)
                         
-                        previews[ratio_name] = {
-                            'url': f'/preview/{preview_filename}',  # CRITICAL: This URL must match app.py route
-                            'dimensions': f"{width} x {height} px",
-                            'preview_size': '300x300 px'
-                        }
+                        # Verify file was created
+                        if os.path.exists(preview_path):
+                            file_size = os.path.getsize(preview_path) / 1024
+                            logger.debug("Preview created: %s (%.1f KB)", preview_filename, file_size)
+                            
+                            previews[ratio_name] = {
+                                'url': f'/preview/{preview_filename}',  # CRITICAL: This URL must match app.py route
+                                'dimensions': f"{width} x {height} px",
+                                'preview_size': '300x300 px'
+                            }
+                        else:
+                            logger.error("Preview file not created: %s", preview_path)
+                            previews[ratio_name] = {
+                                'error': 'Failed to create preview file',
+                                'dimensions': f"{width} x {height} px"
+                            }
                     else:
-                        print(f"ERROR: Preview file not created: {preview_path}")
+                        logger.error("Preview image creation failed for %s", ratio_name)
                         previews[ratio_name] = {
-                            'error': 'Failed to create preview file',
+                            'error': 'Failed to create preview image',
                             'dimensions': f"{width} x {height} px"
                         }
-                else:
-                    print(f"ERROR: Preview image creation failed for {ratio_name}")
+                        
+                except Exception as e:
+                    logger.exception("Error creating preview for %s: %s", ratio_name, e)
                     previews[ratio_name] = {
-                        'error': 'Failed to create preview image',
+                        'error': str(e),
                         'dimensions': f"{width} x {height} px"
                     }
-                    
-            except Exception as e:
-                print(f"Error creating preview for {ratio_name}: {e}")
-                traceback.print_exc()
-                previews[ratio_name] = {
-                    'error': str(e),
-                    'dimensions': f"{width} x {height} px"
-                }
+        finally:
+            source.close()
         
-        print(f"Previews created: {len(previews)} previews ready")
+        logger.debug("Previews created: %s previews ready", len(previews))
         return previews
     
-    def _create_crop_for_preview(self, target_width, target_height):
+    def _load_preview_source(self):
         """
-        Create preview crop with minimal memory usage.
-        Loads image, crops, and returns immediately.
+        Decode the source once for all previews.
+        Memory: JPEGs are decoded at reduced scale, so this stays small.
         """
-        try:
-            # Load image for this specific operation
-            with Image.open(self.image_path) as img:
-                # MEMORY OPTIMIZATION: Resize large source images
-                img = self._resize_if_too_large(img)
-                
-                # Calculate crop (center crop by default)
-                crop_image = self._calculate_crop(img, target_width, target_height)
-                if crop_image:
-                    # Resize to target dimensions for preview
-                    return crop_image.resize((target_width, target_height), Image.Resampling.LANCZOS)
-                return None
-                
-        except Exception as e:
-            print(f"Error in preview crop: {e}")
-            return None
+        with Image.open(self.image_path) as img:
+            # JPEG: let libjpeg decode at 1/2..1/8 scale, keeping at least
+            # twice the preview size so the thumbnails stay sharp
+            full_size = img.size
+            img.draft('RGB', (self.PREVIEW_SIZE * 2, self.PREVIEW_SIZE * 2))
+            if img.size != full_size:
+                logger.debug("Preview draft decode: %sx%s -> %sx%s", full_size[0], full_size[1], img.width, img.height)
+            
+            # Same orientation and mode as the final outputs (see _get_source)
+            source = self._to_output_mode(ImageOps.exif_transpose(img))
+        
+        # MEMORY OPTIMIZATION: Resize large source images
+        resized = self._resize_if_too_large(source)
+        if resized is not source:
+            source.close()
+        return resized
+    
+    def _save_preview(self, preview, preview_path):
+        """
+        Encode a web preview in PREVIEW_FORMAT; returns the encoded bytes.
+        JPEG previews skip the second Huffman pass, not worth it at this size.
+        """
+        buf = io.BytesIO()
+        if self.PREVIEW_FORMAT == 'WEBP':
+            # Pillow converts other modes (CMYK, palette, 16-bit) to RGB(A) itself
+            preview.save(buf, 'WEBP', quality=80, method=4)
+        else:
+            if preview.mode not in ('RGB', 'L', 'CMYK'):
+                # Palette, alpha and 16-bit sources: JPEG can't store these modes
+                preview = preview.convert('RGB')
+            preview.save(
+                buf,
+                'JPEG',
+                quality=82,
+                subsampling=2,     # 4:2:0 chroma is plenty for on-screen previews
+                optimize=False,
+                progressive=True   # Progressive JPEG for faster loading
+            )
+        data = buf.getvalue()
+        with open(preview_path, 'wb') as f:
+            f.write(data)
+        return data
+    
+    def _render_crop(self, img, box, width, height):
+        """
+        Render a crop box of img at the target size. Normally the crop happens
+        inside the resampler (one pass, no crop-sized intermediate); a crop
+        that is already exactly target-sized is copied without resampling.
+        Smaller crops are still enlarged, since the outputs are fixed print sizes.
+        """
+        left, top, right, bottom = box
+        if (right - left, bottom - top) == (width, height):
+            return img.crop(box)
+        return img.resize((width, height), Image.Resampling.LANCZOS, box=box)
+    
+    def _write_jpeg(self, image, path, **params):
+        """
+        Encode a JPEG in memory, then write it with a single write call
+        instead of Pillow's 64KB chunks. Returns the number of bytes written.
+        """
+        buf = io.BytesIO()
+        image.save(buf, 'JPEG', **params)
+        with open(path, 'wb') as f:
+            f.write(buf.getbuffer())
+        return buf.tell()
     
     def adjust_crop(self, ratio, x_offset=0, y_offset=0):
         """
-        Adjust crop position for specific ratio.
+        Adjust crop position for specific ratio (web preview only).
         FIXED: Returns preview filename (not path) for frontend.
         
         Args:
@@ -162,108 +402,270 @@ class ImageProcessor:
             y_offset: Vertical adjustment (-100 to 100)
             
         Returns:
-            Preview filename (e.g., 'sessionid_ratio_preview.jpg') or None if failed
+            Preview filename (e.g., 'sessionid_ratio_preview.webp') or None if failed
         """
-        print(f"Adjusting crop for {ratio}, offset: x={x_offset}, y={y_offset}")
+        logger.debug("Adjusting crop for %s, offset: x=%s, y=%s", ratio, x_offset, y_offset)
         
         if ratio not in self.RATIOS:
-            print(f"ERROR: Invalid ratio: {ratio}")
+            logger.error("Invalid ratio: %s", ratio)
             return None
             
         width, height = self.RATIOS[ratio]
         
+        # CRITICAL: Save preview for frontend display
+        # Use consistent naming convention: sessionid_ratio_preview.<PREVIEW_EXT>
+        preview_filename = f"{self.session_id}_{ratio}_preview.{self.PREVIEW_EXT}"
+        preview_path = os.path.join(self.processed_folder, preview_filename)
+        
+        key = (ratio, x_offset, y_offset)
+        with self._source_lock:
+            cached = self._adjust_cache.get(key)
+            if cached is not None:
+                self._adjust_cache.move_to_end(key)
+        if cached is not None:
+            # Offsets rendered before: just put the cached preview back
+            try:
+                with open(preview_path, 'wb') as f:
+                    f.write(cached)
+                logger.debug("Preview cache hit: %s (%.1f KB)", preview_filename, len(cached) / 1024)
+                return preview_filename
+            except OSError as e:
+                logger.error("Error restoring cached preview: %s", e)
+                return None
+        
         try:
-            # Load image fresh for this operation
-            with Image.open(self.image_path) as img:
-                print(f"Image loaded: {img.width}x{img.height}, mode: {img.mode}")
-                
-                # MEMORY OPTIMIZATION: Resize if too large
-                img = self._resize_if_too_large(img)
-                
-                # Calculate crop with offset
-                crop_image = self._calculate_crop(img, width, height, x_offset, y_offset)
-                if not crop_image:
-                    print(f"ERROR: Crop calculation failed for {ratio}")
-                    return None
-                
-                print(f"Crop calculated: {crop_image.width}x{crop_image.height}")
-                
-                # Resize to target dimensions
-                resized = crop_image.resize((width, height), Image.Resampling.LANCZOS)
-                print(f"Resized to target: {resized.width}x{resized.height}")
-                
-                # Save full size for final output (optional, for download)
-                output_filename = f"{self.session_id}_{ratio}_adjusted.jpg"
-                output_path = os.path.join(self.processed_folder, output_filename)
-                
-                # Preserve color profile
-                if img.mode == 'CMYK':
-                    resized = resized.convert('CMYK')
-                else:
-                    resized = resized.convert('RGB')
-                
-                # Save with moderate quality to save space
-                resized.save(
-                    output_path, 
-                    'JPEG', 
-                    quality=90, 
-                    dpi=(300, 300), 
-                    optimize=True,
-                    progressive=True
-                )
-                print(f"Full size saved: {output_filename}")
-                
-                # CRITICAL: Save preview for frontend display
-                # Use consistent naming convention: sessionid_ratio_preview.jpg
-                preview_filename = f"{self.session_id}_{ratio}_preview.jpg"
-                preview_path = os.path.join(self.processed_folder, preview_filename)
-                
-                # Create thumbnail for preview
-                preview_img = resized.copy()  # Copy to avoid modifying original
-                preview_img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-                
-                # Save preview with optimization
-                preview_img.save(
-                    preview_path, 
-                    'JPEG', 
-                    quality=85, 
-                    optimize=True,
-                    progressive=True
-                )
-                
-                # Verify preview was saved
-                if os.path.exists(preview_path):
-                    preview_size = os.path.getsize(preview_path) / 1024
-                    print(f"Preview saved: {preview_filename} ({preview_size:.1f} KB)")
-                    
-                    # CRITICAL: Return the filename (not path)
-                    # This is what app.py expects for the /preview/<filename> route
-                    return preview_filename
-                else:
-                    print(f"ERROR: Preview file not created at {preview_path}")
-                    return None
+            # Preview only: the full-size render happens once, in
+            # process_all_ratios, from the offsets /download is sent.
+            # Same framing, cropped from the cached preview-scale base
+            preview_base = self._get_preview_base(ratio)
+            preview_box = self._calculate_crop(preview_base, width, height, x_offset, y_offset)
+            if not preview_box:
+                logger.error("Preview crop failed for %s", ratio)
+                return None
+            data = self._save_preview(preview_base.crop(preview_box), preview_path)
+            with self._source_lock:
+                self._adjust_cache[key] = data
+                while len(self._adjust_cache) > self.ADJUST_CACHE_SIZE:
+                    self._adjust_cache.popitem(last=False)
+            
+            # Verify preview was saved
+            if os.path.exists(preview_path):
+                preview_size = os.path.getsize(preview_path) / 1024
+                logger.debug("Preview saved: %s (%.1f KB)", preview_filename, preview_size)
                 
+                # CRITICAL: Return the filename (not path)
+                # This is what app.py expects for the /preview/<filename> route
+                return preview_filename
+            else:
+                logger.error("Preview file not created at %s", preview_path)
+                return None
+            
         except Exception as e:
-            print(f"Error in adjust_crop: {e}")
-            traceback.print_exc()
+            logger.exception("Error in adjust_crop: %s", e)
             return None
     
-    def process_all_ratios(self, adjustments):
+    def process_all_ratios(self, adjustments, base_name=None, executor=None, output_dir=None):
         """
         Process all ratios with adjustments.
-        MEMORY OPTIMIZATION: Process images one at a time.
+        MEMORY OPTIMIZATION: Without an executor, process images one at a time.
         
         Args:
             adjustments: Dictionary of adjustments for each ratio
                 Format: {'2x3': {'x_offset': 10, 'y_offset': -5}, ...}
+            base_name: Output filename prefix (derived from the image path if None)
+            executor: Optional concurrent.futures executor to render the
+                ratios in parallel (Pillow releases the GIL while resizing
+                and encoding, so a thread pool scales across cores)
+            output_dir: Directory to write the outputs to (processed_folder
+                if None); concurrent callers should each pass their own
             
         Returns:
             List of output file paths for the final high-res images
         """
-        output_files = []
+        logger.debug("Processing all ratios for session: %s", self.session_id[:8])
+        
+        if base_name is None:
+            base_name = self._output_base_name()
+        logger.debug("Base filename: %s", base_name)
+        
+        # pyvips: decode once into memory and crop every ratio from it,
+        # rather than each ratio streaming its own decode of the file
+        vips_source = None
+        if pyvips is not None:
+            try:
+                # copy_memory runs the pipeline once, top to bottom, so the
+                # file can be read sequentially
+                shared = self._open_vips(self.RATIOS.values())
+                # Same cap as _get_source before buffering: PNG/TIFF/WebP have
+                # no shrink-on-load and would otherwise be held at full size
+                limit = self._source_limit(shared.width, shared.height)
+                if limit and max(shared.width, shared.height) > limit:
+                    shared = shared.resize(limit / max(shared.width, shared.height))
+                vips_source = shared.copy_memory()
+            except Exception as e:
+                logger.warning("Shared vips decode failed, rendering ratios separately: %s", e)
+        
+        def render(ratio_name):
+            return self.process_one_ratio(ratio_name, adjustments.get(ratio_name), base_name,
+                                          vips_source, output_dir)
+        
+        with self._source_lock:
+            self._source_users += 1
+        try:
+            results = executor.map(render, self.RATIOS) if executor else map(render, self.RATIOS)
+            output_files = [path for path in results if path]
+        finally:
+            # Only the final renders use the full-size source (adjust_crop
+            # works from the preview-scale work image), so the last download
+            # still rendering on this processor drops it rather than keeping
+            # it for a possible repeat; the small preview caches stay
+            with self._source_lock:
+                self._source_users -= 1
+                if not self._source_users:
+                    self._source = None
+        
+        logger.debug("Processing complete: %s files created", len(output_files))
+        return output_files
+    
+    def process_one_ratio(self, ratio_name, adjustment=None, base_name=None, vips_source=None,
+                          output_dir=None):
+        """
+        Render the final high-res image for a single ratio.
         
-        print(f"Processing all ratios for session: {self.session_id[:8]}")
+        Args:
+            ratio_name: Aspect ratio name (e.g., '2x3', '3x4')
+            adjustment: Offsets for this ratio, e.g. {'x_offset': 10, 'y_offset': -5}
+                (defaults to center if None)
+            base_name: Output filename prefix (derived from the image path if None)
+            vips_source: pyvips backend only; decoded source shared by
+                process_all_ratios (streamed from the file if None)
+            output_dir: Directory to write the output to (processed_folder if None)
+            
+        Returns:
+            Output file path or None if failed
+        """
+        if ratio_name not in self.RATIOS:
+            logger.error("Invalid ratio: %s", ratio_name)
+            return None
+        
+        width, height = self.RATIOS[ratio_name]
+        if base_name is None:
+            base_name = self._output_base_name()
         
+        try:
+            logger.debug("Processing ratio: %s (%sx%s)", ratio_name, width, height)
+            
+            # Get adjustments for this ratio (default to center if none)
+            adj = adjustment or {}
+            x_offset = adj.get('x_offset', 0)
+            y_offset = adj.get('y_offset', 0)
+            
+            logger.debug("Using adjustments: x=%s, y=%s", x_offset, y_offset)
+            
+            # Save with proper naming
+            output_filename = f"{base_name}_{ratio_name}.jpg"
+            output_path = os.path.join(output_dir or self.processed_folder, output_filename)
+            
+            if pyvips is not None:
+                file_size = self._render_ratio_vips(width, height, x_offset, y_offset, output_path, vips_source)
+                logger.debug("Saved (vips): %s (%.2f MB)", output_filename, file_size / 1024 / 1024)
+                return output_path
+            
+            # Shared decoded source: ratios rendered concurrently on one
+            # processor decode the file once and only read from it
+            img = self._get_source()
+            logger.debug("Source ready: %sx%s", img.width, img.height)
+            
+            # Calculate crop area
+            box = self._calculate_crop(img, width, height, x_offset, y_offset)
+            if not box:
+                logger.error("Crop calculation failed for %s", ratio_name)
+                return None
+            
+            resized = self._render_crop(img, box, width, height)
+            logger.debug("Resized to: %sx%s", resized.width, resized.height)
+            
+            # Color profile preserved: the source is already RGB or CMYK
+            # (_to_output_mode) and resize keeps its mode
+            
+            # Save with optimized settings
+            file_size = self._write_jpeg(
+                resized,
+                output_path,
+                quality=90,          # Good balance of quality and file size
+                dpi=(300, 300),
+                optimize=True        # Baseline + optimal Huffman: print files gain nothing from
+                                     # progressive scans, which cost ~2x the encode time
+            )
+            resized.close()
+            
+            logger.debug("Saved: %s (%.2f MB)", output_filename, file_size / 1024 / 1024)
+            return output_path
+            
+        except Exception as e:
+            logger.exception("Error processing ratio %s: %s", ratio_name, e)
+            return None
+    
+    def _open_vips(self, targets, access='sequential'):
+        """
+        Open the source with pyvips (lazily: header only until pixels are
+        pulled), EXIF-oriented like _get_source. JPEGs are shrunk on load by
+        the largest power of two up to 8 that keeps every target's crop at
+        least target-sized.
+        """
+        image = pyvips.Image.new_from_file(self.image_path, access=access)
+        
+        if image.get_typeof('orientation') and image.get('orientation') != 1:
+            # Rotating needs random access
+            return pyvips.Image.new_from_file(self.image_path).autorot()
+        
+        if image.get_typeof('vips-loader') and image.get('vips-loader').startswith('jpeg'):
+            shrink = 8
+            for width, height in targets:
+                crop_width, crop_height = self._crop_dimensions(image.width, image.height, width, height)
+                while shrink > 1 and (crop_width // shrink < width or crop_height // shrink < height):
+                    shrink //= 2
+            if shrink > 1:
+                image = pyvips.Image.new_from_file(self.image_path, access=access, shrink=shrink)
+        return image
+    
+    def _render_ratio_vips(self, width, height, x_offset, y_offset, output_path, source=None):
+        """
+        libvips version of process_one_ratio's render. Same framing (offsets
+        are a percentage of the crop) and output: 8-bit RGB, or CMYK for CMYK
+        sources, 300 DPI, q90 baseline. Without a shared source the
+        pipeline streams sequentially from the file.
+        
+        Returns:
+            Bytes written
+        """
+        image = source if source is not None else self._open_vips([(width, height)])
+        
+        box = self._calculate_crop(image, width, height, x_offset, y_offset)
+        if not box:
+            raise ValueError(f"Invalid crop for {image.width}x{image.height}")
+        left, top, right, bottom = box
+        
+        image = image.crop(left, top, right - left, bottom - top)
+        if (image.width, image.height) != (width, height):
+            image = image.resize(width / image.width, vscale=height / image.height, kernel='lanczos3')
+        
+        # Preserve color profile: CMYK stays CMYK, everything else becomes
+        # 8-bit sRGB without alpha, as convert('RGB') does on the Pillow path
+        if image.interpretation != 'cmyk':
+            image = image.colourspace('srgb')
+            if image.hasalpha():
+                image = image.extract_band(0, n=image.bands - 1)
+        
+        image = image.copy(xres=300 / 25.4, yres=300 / 25.4)  # pixels per mm
+        # 4:2:0 like Pillow; libvips would switch to 4:4:4 at Q >= 90
+        data = image.jpegsave_buffer(Q=90, optimize_coding=True, subsample_mode='on')
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return len(data)
+    
+    def _output_base_name(self):
+        """Derive a safe output filename prefix from the original image path."""
         # Extract base filename from original path
         original_name = os.path.basename(self.image_path)
         
@@ -282,146 +684,83 @@ class ImageProcessor:
         base_name = os.path.splitext(base_name)[0]
         
         # Clean base name for safe filenames
-        import re
-        base_name = re.sub(r'[^\w\s\-_.]', '', base_name)
-        base_name = base_name.replace(' ', '_')
-        
-        print(f"Base filename: {base_name}")
-        
-        # PROCESS ONE RATIO AT A TIME (Memory Optimization)
-        for ratio_name, (width, height) in self.RATIOS.items():
-            try:
-                print(f"Processing ratio: {ratio_name} ({width}x{height})")
-                
-                # Get adjustments for this ratio (default to center if none)
-                adj = adjustments.get(ratio_name, {})
-                x_offset = adj.get('x_offset', 0)
-                y_offset = adj.get('y_offset', 0)
-                
-                print(f"  Using adjustments: x={x_offset}, y={y_offset}")
-                
-                # Load image fresh for EACH ratio (prevents memory buildup)
-                with Image.open(self.image_path) as img:
-                    print(f"  Image loaded: {img.width}x{img.height}")
-                    
-                    # MEMORY OPTIMIZATION: Resize if too large
-                    img = self._resize_if_too_large(img)
-                    
-                    # Calculate and create crop
-                    crop_image = self._calculate_crop(img, width, height, x_offset, y_offset)
-                    if not crop_image:
-                        print(f"  ERROR: Crop calculation failed for {ratio_name}")
-                        continue
-                    
-                    print(f"  Crop created: {crop_image.width}x{crop_image.height}")
-                    
-                    # Resize to target dimensions
-                    resized = crop_image.resize((width, height), Image.Resampling.LANCZOS)
-                    print(f"  Resized to: {resized.width}x{resized.height}")
-                    
-                    # Save with proper naming
-                    output_filename = f"{base_name}_{ratio_name}.jpg"
-                    output_path = os.path.join(self.processed_folder, output_filename)
-                    
-                    # Preserve color profile
-                    if img.mode == 'CMYK':
-                        resized = resized.convert('CMYK')
-                        print(f"  Converted to CMYK")
-                    else:
-                        resized = resized.convert('RGB')
-                        print(f"  Converted to RGB")
-                    
-                    # Save with optimized settings
-                    resized.save(
-                        output_path, 
-                        'JPEG', 
-                        quality=90,          # Good balance of quality and file size
-                        dpi=(300, 300),
-                        optimize=True,       # Enable JPEG optimization
-                        progressive=True     # Progressive JPEG for web
-                    )
-                    
-                    # Verify file was saved
-                    if os.path.exists(output_path):
-                        file_size = os.path.getsize(output_path) / 1024 / 1024
-                        print(f"  Saved: {output_filename} ({file_size:.2f} MB)")
-                        output_files.append(output_path)
-                    else:
-                        print(f"  ERROR: File not saved: {output_path}")
-                    
-                    # Clear variables to help garbage collection
-                    crop_image = None
-                    resized = None
-                    
-            except Exception as e:
-                print(f"Error processing ratio {ratio_name}: {e}")
-                traceback.print_exc()
-                continue
-        
-        print(f"Processing complete: {len(output_files)} files created")
-        return output_files
+        base_name = _FILENAME_CLEAN_RE.sub('', base_name)
+        return base_name.replace(' ', '_')
     
-    def _resize_if_too_large(self, image):
+    def _resize_if_too_large(self, image, limit=None):
         """
         MEMORY OPTIMIZATION: Resize source image if it's too large.
         Prevents processing multi-gigapixel images on limited memory.
         
         Args:
             image: PIL Image object
+            limit: Longest side to shrink to; defaults to _source_limit of its
+                size (pass the original's limit for a draft-decoded image)
             
         Returns:
             Resized image if needed, otherwise original
         """
         width, height = image.size
+        if limit is None:
+            limit = self._source_limit(width, height)
+        if not limit or max(width, height) <= limit:
+            return image
         
-        # Check if image exceeds safe dimensions
-        if width > self.MAX_MEMORY_SAFE_DIMENSION or height > self.MAX_MEMORY_SAFE_DIMENSION:
-            print(f"WARNING: Source image too large ({width}x{height}). Resizing for memory safety.")
-            
-            # Calculate new size maintaining aspect ratio
-            if width > height:
-                new_width = self.MAX_MEMORY_SAFE_DIMENSION
-                new_height = int(self.MAX_MEMORY_SAFE_DIMENSION * height / width)
-            else:
-                new_height = self.MAX_MEMORY_SAFE_DIMENSION
-                new_width = int(self.MAX_MEMORY_SAFE_DIMENSION * width / height)
-            
-            print(f"  Resizing to: {new_width}x{new_height}")
-            # Resize with high-quality algorithm
-            return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        if max(width, height) > self.MAX_MEMORY_SAFE_DIMENSION:
+            logger.warning("Source image too large (%sx%s). Resizing for memory safety.", width, height)
+        else:
+            logger.info("Resizing large image (%sx%s) for better performance.", width, height)
         
-        # Optional: Resize if larger than recommended processing size
-        elif width > self.MAX_SOURCE_DIMENSION or height > self.MAX_SOURCE_DIMENSION:
-            print(f"INFO: Resizing large image ({width}x{height}) for better performance.")
-            
-            if width > height:
-                new_width = self.MAX_SOURCE_DIMENSION
-                new_height = int(self.MAX_SOURCE_DIMENSION * height / width)
-            else:
-                new_height = self.MAX_SOURCE_DIMENSION
-                new_width = int(self.MAX_SOURCE_DIMENSION * width / height)
-            
-            print(f"  Resizing to: {new_width}x{new_height}")
+        # Calculate new size maintaining aspect ratio
+        if width > height:
+            new_width = limit
+            new_height = int(limit * height / width)
+        else:
+            new_height = limit
+            new_width = int(limit * width / height)
+        
+        logger.debug("Resizing to: %sx%s", new_width, new_height)
+        
+        # Shrink by the whole-number part of the factor with a cheap box
+        # average first (huge non-JPEG sources; JPEGs are drafted instead),
+        # leaving LANCZOS only the residual < 2x step
+        factor = max(width, height) // limit
+        if factor < 2 or image.mode in ('1', 'P'):
+            # Resize with high-quality algorithm ('1' and 'P' images can't be
+            # reduced; Pillow resamples them with NEAREST regardless)
             return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
         
-        return image
+        reduced = image.reduce(factor)
+        try:
+            return reduced.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        finally:
+            reduced.close()
     
-    def _calculate_crop(self, image, target_width, target_height, x_offset=0, y_offset=0):
-        """
-        Calculate crop area with offset.
-        
-        Args:
-            image: PIL Image object
-            target_width: Desired crop width
-            target_height: Desired crop height
-            x_offset: Horizontal adjustment (-100 to 100)
-            y_offset: Vertical adjustment (-100 to 100)
-            
-        Returns:
-            Cropped PIL Image object or None if failed
-        """
-        img_width, img_height = image.size
-        
+    def _source_limit(self, width, height):
+        """Longest side _resize_if_too_large shrinks an image to, or None."""
+        longest = max(width, height)
+        if longest > self.MAX_MEMORY_SAFE_DIMENSION:
+            limit = self.MAX_MEMORY_SAFE_DIMENSION
+        elif longest > self.MAX_SOURCE_DIMENSION:
+            limit = self.MAX_SOURCE_DIMENSION
+        else:
+            return None
+        # No need to keep more pixels than the largest output crop uses:
+        # every ratio renders from this one cached copy, so shrink it to the
+        # smallest size whose crops still cover their targets
+        return min(limit, self._target_limit(width, height))
+    
+    def _target_limit(self, width, height):
+        """Smallest longest side at which every RATIOS crop is target-sized."""
+        scale = 0
+        for target_width, target_height in self.RATIOS.values():
+            crop_width, crop_height = self._crop_dimensions(width, height, target_width, target_height)
+            scale = max(scale, target_width / crop_width, target_height / crop_height)
+        # +1 absorbs the int() truncation of the resized short side and crop
+        return math.ceil(max(width, height) * scale) + 1
+    
+    def _crop_dimensions(self, img_width, img_height, target_width, target_height):
+        """Largest crop size with the target aspect ratio that fits the image."""
         # Calculate aspect ratios
         target_ratio = target_width / target_height
         img_ratio = img_width / img_height
@@ -435,6 +774,24 @@ class ImageProcessor:
             # Image is taller than target - crop height
             crop_width = img_width
             crop_height = int(crop_width / target_ratio)
+        return crop_width, crop_height
+    
+    def _calculate_crop(self, image, target_width, target_height, x_offset=0, y_offset=0):
+        """
+        Calculate crop area with offset.
+        
+        Args:
+            image: PIL Image object (or a pyvips Image; only its size is used)
+            target_width: Desired crop width
+            target_height: Desired crop height
+            x_offset: Horizontal adjustment (-100 to 100)
+            y_offset: Vertical adjustment (-100 to 100)
+            
+        Returns:
+            Crop box (left, top, right, bottom) within image, or None if failed
+        """
+        img_width, img_height = image.width, image.height
+        crop_width, crop_height = self._crop_dimensions(img_width, img_height, target_width, target_height)
         
         # Calculate crop area with offset (percentage based)
         # Convert percentage offset to pixel offset
@@ -455,17 +812,16 @@ class ImageProcessor:
         
         # Verify crop dimensions
         if right <= left or bottom <= top:
-            print(f"ERROR: Invalid crop dimensions: {left},{top},{right},{bottom}")
+            logger.error("Invalid crop dimensions: %s,%s,%s,%s", left, top, right, bottom)
             return None
         
         if right > img_width or bottom > img_height:
-            print(f"ERROR: Crop out of bounds: {right}x{bottom} > {img_width}x{img_height}")
+            logger.error("Crop out of bounds: %sx%s > %sx%s", right, bottom, img_width, img_height)
             return None
         
-        print(f"  Crop area: ({left},{top}) to ({right},{bottom}), size: {crop_width}x{crop_height}")
+        logger.debug("Crop area: (%s,%s) to (%s,%s), size: %sx%s", left, top, right, bottom, crop_width, crop_height)
         
-        # Perform crop
-        return image.crop((left, top, right, bottom))
+        return (left, top, right, bottom)
     
     def get_memory_usage(self):
         """Estimate memory usage for current operations."""
@@ -485,6 +841,12 @@ class ImageProcessor:
         }
 
 
+# Pillow warns above MAX_IMAGE_PIXELS and raises DecompressionBombError from
+# Image.open at twice that, before any pixels are decoded. This rejects
+# anything over 256MP; large camera JPEGs below that are draft-decoded near
+# the size cap by _get_source, so they never need a full-size buffer.
+Image.MAX_IMAGE_PIXELS = ImageProcessor.MAX_MEMORY_SAFE_DIMENSION ** 2 * 2
+
 # ============================================================================
 # TESTING FUNCTION
 # ============================================================================
@@ -497,7 +859,7 @@ def test_image_processor():
     test_image_path = "test_image.jpg"
     if not os.path.exists(test_image_path):
         print("Creating test image...")
-        from PIL import Image, ImageDraw
+        from PIL import ImageDraw
         img = Image.new('RGB', (4000, 3000), color='blue')
         draw = ImageDraw.Draw(img)
         draw.rectangle([1000, 1000, 3000, 2000], fill='red')
@@ -528,6 +890,21 @@ def test_image_processor():
     output_files = processor.process_all_ratios(adjustments)
     print(f"Created {len(output_files)} output files")
     
+    # Rotated phone photo: stored portrait, EXIF orientation 8 displays it
+    # landscape, so the cached source must be capped as 9000x6000
+    print("\n4. Testing EXIF-rotated source...")
+    rotated_path = "test_image_rotated.jpg"
+    rotated = Image.new('RGB', (6000, 9000), color='green')
+    exif = rotated.getexif()
+    exif[0x0112] = 8
+    rotated.save(rotated_path, 'JPEG', quality=80, exif=exif)
+    rotated_processor = ImageProcessor(rotated_path, session_id, "test_output")
+    source_size = rotated_processor._get_source().size
+    assert source_size == (8000, 5333), source_size
+    print(f"Rotated source cached at {source_size[0]}x{source_size[1]}")
+    rotated_processor.close()
+    os.remove(rotated_path)
+    
     # Cleanup test files
     import shutil
     if os.path.exists("test_output"):
@@ -537,4 +914,5 @@ def test_image_processor():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
     test_image_processor()
\ No newline at end of file
@@ -0,0 +1,74 @@
+# utils/preview_tasks.py
+"""
+Background preview generation for /upload.
+Runs in an RQ worker (`rq worker` from the project root) when REDIS_URL is set,
+otherwise in app.py's in-process thread pool.
+"""
+
+import os
+import json
+import logging
+
+from utils.image_processor import ImageProcessor
+from utils.dpi_checker import check_dpi
+
+logger = logging.getLogger(__name__)
+
+
+def preview_result_path(session_id, processed_folder):
+    """Where build_previews stores its result for the status endpoint."""
+    return os.path.join(processed_folder, f"{session_id}_previews.json")
+
+
+def build_previews(original_path, session_id, processed_folder):
+    """
+    Check DPI and create all ratio previews for an uploaded image.
+
+    The result is also written next to the previews so any app worker
+    can answer /preview_status, not just the one that queued the job.
+    If the job fails, a {'status': 'failed'} marker is written instead
+    and the exception re-raised.
+
+    Returns:
+        {'dpi_warning': str or None, 'previews': {...}}
+    """
+    result_path = preview_result_path(session_id, processed_folder)
+    try:
+        dpi_warning = check_dpi(original_path)
+        if dpi_warning:
+            logger.info("Low DPI detected: %s, session: %s", os.path.basename(original_path), session_id[:8])
+
+        processor = ImageProcessor(original_path, session_id, processed_folder)
+        result = {
+            'dpi_warning': dpi_warning,
+            'previews': processor.create_previews()
+        }
+    except Exception as e:
+        # Polls routed to other workers can't see this job's exception
+        try:
+            _write_result(result_path, {'status': 'failed', 'error': str(e)})
+        except OSError:
+            pass
+        raise
+
+    _write_result(result_path, result)
+    return result
+
+
+def _write_result(result_path, result):
+    """Write then rename so readers never see a partial file."""
+    with open(result_path + '.tmp', 'w') as f:
+        json.dump(result, f)
+    os.replace(result_path + '.tmp', result_path)
+
+
+def load_preview_result(session_id, processed_folder):
+    """
+    Return a finished build_previews result, a {'status': 'failed'}
+    marker if the job failed, or None if not ready.
+    """
+    try:
+        with open(preview_result_path(session_id, processed_folder)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None